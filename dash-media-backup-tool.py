@@ -14,6 +14,8 @@ Options:
     --retry            Number of retries per file (default 3)
     --timeout          Per-request timeout seconds (default 30)
     --dry-run          Parse & list URLs without downloading
+    --no-resume        Re-download files that already exist and ignore partial .part files
+    --breaker-threshold  Files in a row that must fail on a host before its circuit opens (default 20, 0 = never)
     --headers          Extra HTTP headers, e.g. --headers "Authorization: Bearer TOKEN" (repeatable)
     --user-agent       Custom User-Agent string
     --only-domain      Restrict downloads to this domain (safety check)
@@ -22,29 +24,82 @@ Options:
 
 import argparse
 import concurrent.futures
+import functools
 import os
+import random
 import re
 import sys
+import threading
 import time
 import urllib.parse
+import urllib.request
+from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
 from dataclasses import dataclass
 
 try:
     import requests
+    import urllib3
 except ImportError:
     print("This script requires 'requests'. Install it with: pip install requests")
     sys.exit(1)
 
-import xml.etree.ElementTree as ET
+try:
+    # lxml's C parser is much faster on large manifests; it is optional.
+    from lxml import etree as ET
+    HAVE_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAVE_LXML = False
 
 MPD_NS = {'mpd': 'urn:mpeg:dash:schema:mpd:2011'}
+CHUNK_SIZE = 262144
+BREAKER_THRESHOLD = 20    # default for --breaker-threshold
+BREAKER_COOLDOWN = 30.0   # seconds a tripped host fails fast before a probe (jittered)
+
+def _tag(name: str) -> str:
+    return f"{{{MPD_NS['mpd']}}}{name}"
+
+TAG_MPD = _tag('MPD')
+TAG_PERIOD = _tag('Period')
+TAG_ADAPTATION_SET = _tag('AdaptationSet')
+TAG_REPRESENTATION = _tag('Representation')
+
+# Child lookups compiled once: XPath objects under lxml, pre-built '{ns}tag'
+# strings otherwise, rather than re-resolving 'mpd:...' paths on every call.
+def _compile_findall(name: str) -> Callable[[ET.Element], list]:
+    if HAVE_LXML:
+        return ET.XPath(f"mpd:{name}", namespaces=MPD_NS)
+    tag = _tag(name)
+    return lambda elem: elem.findall(tag)
+
+def _compile_find(name: str) -> Callable[[ET.Element], Optional[ET.Element]]:
+    if HAVE_LXML:
+        xp = ET.XPath(f"mpd:{name}[1]", namespaces=MPD_NS)
+        return lambda elem: next(iter(xp(elem)), None)
+    tag = _tag(name)
+    return lambda elem: elem.find(tag)
+
+_findall_baseurl = _compile_findall('BaseURL')
+_findall_s = _compile_findall('S')
+_findall_segment_url = _compile_findall('SegmentURL')
+_find_segment_template = _compile_find('SegmentTemplate')
+_find_segment_list = _compile_find('SegmentList')
+_find_segment_timeline = _compile_find('SegmentTimeline')
+_find_initialization = _compile_find('Initialization')
+
+# $Number$, $Time$, ... with an optional %0<width>d, plus the '$$' escape.
+_TEMPLATE_RE = re.compile(r"\$(Number|Time|RepresentationID|Bandwidth|)(?:%0(\d+)d)?\$")
+# Private-use character standing in for $Number$/$Time$ while a template is joined to its base
+_SLOT = "\ue000"
 
 @dataclass
 class DownloadItem:
     url: str
     relpath: str
+    kind: str = "media"  # or "init"
 
 # ---------------------------------------------------------------------------
 
@@ -58,11 +113,17 @@ def parse_args():
     ap.add_argument("--retry", type=int, default=3)
     ap.add_argument("--timeout", type=int, default=30)
     ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--no-resume", action="store_true")
+    ap.add_argument("--breaker-threshold", type=int, default=BREAKER_THRESHOLD)
     ap.add_argument("--headers", action="append")
     ap.add_argument("--user-agent", default="dash-downloader/1.1")
     ap.add_argument("--only-domain")
     ap.add_argument("--verbose", action="store_true")
-    return ap.parse_args()
+    args = ap.parse_args()
+    # Built once here instead of on every matches_filters() call
+    args._id_filter = frozenset(args.filter_repr_id or ())
+    args._mime_filter = tuple(m.lower() for m in (args.filter_mime or ()))
+    return args
 
 # ---------------------------------------------------------------------------
 
@@ -77,15 +138,122 @@ def merge_headers(args) -> Dict[str, str]:
             headers[k.strip()] = v.strip()
     return headers
 
-def read_manifest(manifest: str, headers: Dict[str, str], timeout: int) -> Tuple[str, bytes]:
+def make_session(headers: Dict[str, str]) -> "requests.Session":
+    # Only the manifest goes through requests; segments use make_pool().
+    session = requests.Session()
+    session.headers.update(headers)
+    return session
+
+def _ca_kwargs() -> Dict[str, str]:
+    # Same lookup order as requests, so both paths trust the same CAs.
+    bundle = (os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get("CURL_CA_BUNDLE")
+              or requests.certs.where())
+    return {"ca_cert_dir": bundle} if os.path.isdir(bundle) else {"ca_certs": bundle}
+
+class ProxyUnavailable(Exception):
+    """The configured proxy cannot be used; retrying the file will not help."""
+
+class SegmentPool:
+    """
+    Routes each segment request to a direct pool or to the environment proxy
+    for its scheme (HTTP(S)_PROXY / ALL_PROXY, minus NO_PROXY), as requests
+    would. A proxy manager is only built once a host that is not bypassed
+    needs it, and bypass decisions are cached per host.
+    """
+
+    def __init__(self, headers: Dict[str, str], **pool_kw) -> None:
+        self.headers = headers
+        self._pool_kw = pool_kw
+        self._direct = urllib3.PoolManager(headers=headers, **pool_kw)
+        env = urllib.request.getproxies()
+        self._proxy_urls = {scheme: env.get(scheme) or env.get("all") for scheme in ("http", "https")}
+        # scheme -> manager, or the reason it could not be built
+        self._proxied: Dict[str, object] = {}
+        self._bypass: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def _proxy_manager(self, proxy: str) -> "urllib3.PoolManager":
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        parts = urllib.parse.urlsplit(proxy)
+        if parts.scheme.startswith("socks"):
+            try:
+                from urllib3.contrib.socks import SOCKSProxyManager
+            except ImportError:
+                raise ProxyUnavailable(f"{parts.scheme}:// proxy needs PySocks (pip install pysocks)")
+            return SOCKSProxyManager(proxy, headers=self.headers, **self._pool_kw)
+        if parts.scheme not in ("http", "https"):
+            raise ProxyUnavailable(f"unsupported proxy scheme {parts.scheme}://")
+        proxy_headers = None
+        if parts.username is not None:
+            auth = f"{urllib.parse.unquote(parts.username)}:{urllib.parse.unquote(parts.password or '')}"
+            proxy_headers = urllib3.make_headers(proxy_basic_auth=auth)
+            proxy = parts._replace(netloc=parts.netloc.rpartition("@")[2]).geturl()
+        return urllib3.ProxyManager(proxy, proxy_headers=proxy_headers,
+                                    headers=self.headers, **self._pool_kw)
+
+    def _manager_for(self, url: str) -> "urllib3.PoolManager":
+        parts = urllib.parse.urlsplit(url)
+        proxy = self._proxy_urls.get(parts.scheme)
+        if not proxy:
+            return self._direct
+        bypass = self._bypass.get(parts.netloc)
+        if bypass is None:
+            bypass = self._bypass[parts.netloc] = bool(urllib.request.proxy_bypass(parts.netloc))
+        if bypass:
+            return self._direct
+        with self._lock:
+            manager = self._proxied.get(parts.scheme)
+            if manager is None:
+                try:
+                    manager = self._proxy_manager(proxy)
+                except ProxyUnavailable as e:
+                    manager = str(e)
+                self._proxied[parts.scheme] = manager
+        if isinstance(manager, str):
+            raise ProxyUnavailable(manager)
+        return manager
+
+    def request(self, method: str, url: str, **kw) -> "urllib3.HTTPResponse":
+        return self._manager_for(url).request(method, url, **kw)
+
+    def clear(self) -> None:
+        self._direct.clear()
+        for manager in self._proxied.values():
+            if not isinstance(manager, str):
+                manager.clear()
+
+def make_pool(headers: Dict[str, str], num_hosts: int, per_host: int) -> SegmentPool:
+    """
+    Segment connection pools: one per host so none is evicted, each holding up to
+    per_host keep-alive sockets. Blocking means workers wait for a free pooled
+    connection instead of opening throwaway ones. Plain urllib3 skips the
+    per-request preparation (hooks, cookies) that requests does.
+    """
+    return SegmentPool(
+        headers, num_pools=max(1, num_hosts), maxsize=max(1, per_host), block=True,
+        cert_reqs="CERT_REQUIRED", **_ca_kwargs(),
+        # download_one() does its own retries; only redirects are followed here.
+        retries=urllib3.Retry(total=None, connect=0, read=0, other=0, status=0, redirect=5))
+
+@contextmanager
+def open_manifest(manifest: str, session: "requests.Session",
+                  timeout: int) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Yield (base_url, stream) for the manifest without reading it into memory,
+    so it can be parsed incrementally while it is still arriving.
+    """
     if re.match(r"^https?://", manifest, re.I):
-        r = requests.get(manifest, headers=headers, timeout=timeout)
-        r.raise_for_status()
-        return manifest, r.content
+        with session.get(manifest, stream=True, timeout=timeout) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            yield manifest, r.raw
     else:
         path = Path(manifest).resolve()
-        return path.as_uri(), path.read_bytes()
+        with path.open("rb") as f:
+            yield path.as_uri(), f
 
+@functools.lru_cache(maxsize=8192)
 def join_url(base: str, part: str) -> str:
     return urllib.parse.urljoin(base, part)
 
@@ -104,91 +272,162 @@ def _clean_baseurl_text(text: Optional[str]) -> Optional[str]:
 def get_all_baseurls(elem: ET.Element) -> List[str]:
     # Collect BaseURL texts, dropping empty and '/' which would reset to domain root.
     urls = []
-    for b in elem.findall('mpd:BaseURL', MPD_NS):
+    for b in _findall_baseurl(elem):
         t = _clean_baseurl_text(b.text)
         if t is not None:
             urls.append(t)
     # If nothing meaningful at this level, return [''] so upper level base is preserved
     return urls or ['']
 
+def extend_bases(bases: List[str], elem: ET.Element) -> List[str]:
+    """Apply elem's BaseURLs on top of the parent's effective bases."""
+    parts = get_all_baseurls(elem)
+    if parts == ['']:
+        return bases
+    # Only multiple BaseURLs fork; an absolute one collapses its parents, so dedupe.
+    return list(dict.fromkeys(join_url(b, p) if p else b for b in bases for p in parts))
+
 def ensure_relpath_from_url(url: str) -> str:
-    p = urllib.parse.urlparse(url)
+    p = urllib.parse.urlsplit(url)
     rel = p.path.lstrip('/')
     if p.query:
         rel = os.path.join(rel, urllib.parse.quote_plus(p.query))
     return rel
 
-def add_item(items: Dict[str, "DownloadItem"], url: str):
-    items[url] = DownloadItem(url, ensure_relpath_from_url(url))
+def add_item(urls: Dict[str, str], url: str, kind: str = "media"):
+    # Only the URL and its kind are recorded here; DownloadItems are built once
+    # per unique URL at the end. A dict rather than a set keeps manifest order.
+    urls.setdefault(url, kind)
 
-def expand_media_template(pat: str, rep: ET.Element, number=None, time=None) -> str:
-    out = pat
-    if "$Number" in out:
-        if number is None:
+def _escape_format(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+def compile_template(pat: str, rep: ET.Element, base: Optional[str] = None) -> Callable[..., str]:
+    """
+    Tokenize a SegmentTemplate pattern once per Representation. $RepresentationID$
+    and $Bandwidth$ are substituted right away; the returned callable
+    (number=None, time=None) only does a str.format per segment.
+    With base, the pattern is also resolved against it once up front (with slots
+    standing in for $Number$/$Time$), so the callable returns absolute URLs
+    without a per-segment urljoin.
+    """
+    literals = [""]  # text around each $Number$/$Time$ slot
+    fields = []      # format field for each slot
+    pos = 0
+    for m in _TEMPLATE_RE.finditer(pat):
+        literals[-1] += pat[pos:m.start()]
+        name, width = m.group(1), m.group(2)
+        if name == "":
+            literals[-1] += "$"
+        elif name == "RepresentationID":
+            literals[-1] += rep.get('id') or ''
+        elif name == "Bandwidth":
+            bw = rep.get('bandwidth') or ''
+            literals[-1] += f"{int(bw):0{width}d}" if width and bw.isdigit() else bw
+        else:
+            key = name.lower()
+            fields.append(f"{{{key}:0{width}d}}" if width else f"{{{key}}}")
+            literals.append("")
+        pos = m.end()
+    literals[-1] += pat[pos:]
+    join_base = None
+    if base is not None:
+        joined = join_url(base, _SLOT.join(literals)).split(_SLOT)
+        if len(joined) == len(literals):
+            literals = joined
+        else:
+            # A slot got folded away (e.g. '$Number$/../x'); resolve each segment instead.
+            join_base = base
+    render = "".join([_escape_format(literals[0])] +
+                     [f + _escape_format(lit) for f, lit in zip(fields, literals[1:])]).format
+    needs_number = any(f.startswith("{number") for f in fields)
+    needs_time = any(f.startswith("{time") for f in fields)
+
+    def expand(number=None, time=None) -> str:
+        if needs_number and number is None:
             raise RuntimeError("Template uses $Number$ but number=None")
-        out = re.sub(r"\$Number(%0(\d+)d)?\$", 
-                     lambda m: f"{number:0{m.group(2)}d}" if m.group(2) else str(number), out)
-    if "$Time$" in out:
-        if time is None:
+        if needs_time and time is None:
             raise RuntimeError("Template uses $Time$ but time=None")
-        out = out.replace("$Time$", str(time))
-    if "$RepresentationID$" in out:
-        out = out.replace("$RepresentationID$", rep.get('id') or '')
-    if "$Bandwidth$" in out:
-        out = out.replace("$Bandwidth$", rep.get('bandwidth') or '')
-    return out
-
-def initialize_url_pattern(pat: str, rep: ET.Element) -> str:
-    return (pat
-        .replace("$RepresentationID$", rep.get('id') or '')
-        .replace("$Bandwidth$", rep.get('bandwidth') or ''))
+        url = render(number=number, time=time)
+        return url if join_base is None else join_url(join_base, url)
+    return expand
 
 # ---------------------------------------------------------------------------
 
-def effective_base_urls_hierarchy(root: ET.Element, base: str):
+def iterparse_mpd(source: BinaryIO):
+    if HAVE_LXML:
+        # Manifests come from the network: never expand entities or fetch DTDs.
+        return ET.iterparse(source, events=("start", "end"),
+                            resolve_entities=False, no_network=True)
+    return ET.iterparse(source, events=("start", "end"))
+
+# Tag paths, from the root, of the elements whose subtrees we drop once handled.
+_REPRESENTATION_PATH = (TAG_MPD, TAG_PERIOD, TAG_ADAPTATION_SET, TAG_REPRESENTATION)
+_PRUNE_PATHS = {_REPRESENTATION_PATH, _REPRESENTATION_PATH[:3], _REPRESENTATION_PATH[:2]}
+
+def effective_base_urls_hierarchy(source: BinaryIO, base: str,
+                                  keep: Optional[Callable[..., bool]] = None):
     """
-    Build effective base URLs for (Representation, AdaptationSet, effective_base).
+    Stream (Representation, AdaptationSet, effective_base) while the manifest is parsed,
+    skipping Representations for which keep(rep, adp) is false before any BaseURL work.
     We 'stack' BaseURL from MPD -> Period -> AdaptationSet -> Representation,
     but ignore BaseURL values that are '' or '/' (no-ops that otherwise reset to host root).
+    The schema puts BaseURL before child Periods/AdaptationSets/Representations, so the
+    ancestors' BaseURLs are already parsed when a Representation closes. Each handled
+    subtree is then detached, keeping memory at roughly one Representation.
     """
-    out = []
-    mpd_bases = [join_url(base, b) for b in get_all_baseurls(root)]
-    for period in root.findall('mpd:Period', MPD_NS):
-        p_bases = [join_url(m, b) for m in mpd_bases for b in get_all_baseurls(period)]
-        for adp in period.findall('mpd:AdaptationSet', MPD_NS):
-            a_bases = [join_url(p, b) for p in p_bases for b in get_all_baseurls(adp)]
-            for rep in adp.findall('mpd:Representation', MPD_NS):
-                r_bases = [join_url(a, b) for a in a_bases for b in get_all_baseurls(rep)]
-                for eff in r_bases:
-                    out.append((rep, adp, eff))
-    return out
+    stack = []
+    level_bases = []  # effective bases of each open element, resolved on first use
+    for event, elem in iterparse_mpd(source):
+        if event == "start":
+            stack.append(elem)
+            level_bases.append(None)
+            continue
+        path = tuple(e.tag for e in stack)
+        stack.pop()
+        level_bases.pop()
+        if path == _REPRESENTATION_PATH and (keep is None or keep(elem, stack[-1])):
+            for i, level in enumerate(stack):
+                if level_bases[i] is None:
+                    level_bases[i] = extend_bases(level_bases[i - 1] if i else [base], level)
+            for eff in extend_bases(level_bases[-1], elem):
+                yield elem, stack[-1], eff
+        if path in _PRUNE_PATHS:
+            stack[-1].remove(elem)
 
 def matches_filters(rep, adp, args):
-    if args.filter_repr_id and (rep.get('id') not in args.filter_repr_id):
+    if args._id_filter and (rep.get('id') not in args._id_filter):
         return False
-    if args.filter_mime:
+    if args._mime_filter:
         mime = rep.get('mimeType') or adp.get('mimeType') or ''
-        if not any(mime.lower().startswith(m.lower()) for m in args.filter_mime):
+        if not mime.lower().startswith(args._mime_filter):
             return False
     return True
 
 # ---------------------------------------------------------------------------
 
-def parse_segment_template(rep, adp, base, items):
-    st = rep.find('mpd:SegmentTemplate', MPD_NS) or adp.find('mpd:SegmentTemplate', MPD_NS)
+def find_inherited(rep, adp, find):
+    # Element truthiness means "has children", so `rep.find() or adp.find()`
+    # would skip a childless Representation-level element; test for None.
+    found = find(rep)
+    return found if found is not None else find(adp)
+
+def parse_segment_template(rep, adp, base, urls):
+    st = find_inherited(rep, adp, _find_segment_template)
     if st is None:
         return
     init = st.get('initialization')
     media = st.get('media')
     if init:
-        add_item(items, join_url(base, initialize_url_pattern(init, rep)))
+        add_item(urls, compile_template(init, rep, base)(), "init")
     if not media:
         return
-    timeline = st.find('mpd:SegmentTimeline', MPD_NS)
+    url_for = compile_template(media, rep, base)
+    timeline = _find_segment_timeline(st)
     start_number = int(st.get('startNumber') or '1')
     if timeline is not None:
         current_time = None
-        for s in timeline.findall('mpd:S', MPD_NS):
+        for s in _findall_s(timeline):
             r = int(s.get('r') or '0')
             d = s.get('d')
             t = s.get('t')
@@ -196,110 +435,381 @@ def parse_segment_template(rep, adp, base, items):
                 current_time = int(t)
             elif current_time is None:
                 current_time = 0
-            for _ in range(r + 1):
-                seg = expand_media_template(media, rep, time=current_time)
-                add_item(items, join_url(base, seg))
-                if d is not None:
-                    current_time += int(d)
+            # Segment start times of this run, as a range rather than a Python-level
+            # += loop; long live DVR windows are often a single <S r="N">.
+            count = max(r + 1, 0)
+            step = int(d) if d is not None else 0
+            if step:
+                times = range(current_time, current_time + count * step, step)
+            else:
+                times = [current_time] * count
+            current_time += count * step
+            for t in times:
+                add_item(urls, url_for(time=t))
     else:
         count_env = os.getenv("DASH_SEGMENT_COUNT")
         if not count_env:
             raise RuntimeError("Need DASH_SEGMENT_COUNT for number-based SegmentTemplate")
         count = int(count_env)
         for i in range(start_number, start_number + count):
-            seg = expand_media_template(media, rep, number=i)
-            add_item(items, join_url(base, seg))
+            add_item(urls, url_for(number=i))
 
-def parse_segment_list(rep, adp, base, items):
-    sl = rep.find('mpd:SegmentList', MPD_NS) or adp.find('mpd:SegmentList', MPD_NS)
+def parse_segment_list(rep, adp, base, urls):
+    sl = find_inherited(rep, adp, _find_segment_list)
     if sl is None:
         return
-    init = sl.find('mpd:Initialization', MPD_NS)
+    init = _find_initialization(sl)
     if init is not None and init.get('sourceURL'):
-        add_item(items, join_url(base, init.get('sourceURL')))
-    for su in sl.findall('mpd:SegmentURL', MPD_NS):
+        add_item(urls, join_url(base, init.get('sourceURL')), "init")
+    for su in _findall_segment_url(sl):
         media = su.get('media')
         if media:
-            add_item(items, join_url(base, media))
+            add_item(urls, join_url(base, media))
 
 # ---------------------------------------------------------------------------
 
-def collect_items(mpd_xml: bytes, base_url: str, args):
-    root = ET.fromstring(mpd_xml)
-    items = {}
-    for rep, adp, eff in effective_base_urls_hierarchy(root, base_url):
-        if not matches_filters(rep, adp, args):
-            continue
-        parse_segment_list(rep, adp, eff, items)
-        parse_segment_template(rep, adp, eff, items)
+def collect_items(source: BinaryIO, base_url: str, args):
+    urls = {}
+    keep = lambda rep, adp: matches_filters(rep, adp, args)
+    for rep, adp, eff in effective_base_urls_hierarchy(source, base_url, keep):
+        parse_segment_list(rep, adp, eff, urls)
+        parse_segment_template(rep, adp, eff, urls)
         # If nothing explicit, treat eff as a direct file (rare)
-        path = urllib.parse.urlparse(eff).path
-        if not items and os.path.splitext(path)[1]:
-            add_item(items, eff)
-    return list(items.values())
+        if not urls and os.path.splitext(urllib.parse.urlsplit(eff).path)[1]:
+            add_item(urls, eff)
+    return [DownloadItem(u, ensure_relpath_from_url(u), kind) for u, kind in urls.items()]
+
+def group_by_host(items: List[DownloadItem]) -> Dict[str, List[DownloadItem]]:
+    """Bucket items by netloc, keeping the first-seen order of hosts and items."""
+    groups: Dict[str, List[DownloadItem]] = {}
+    for it in items:
+        groups.setdefault(urllib.parse.urlsplit(it.url).netloc, []).append(it)
+    return groups
 
 # ---------------------------------------------------------------------------
 
 def check_domain(url: str, only_domain: Optional[str]) -> bool:
     if not only_domain:
         return True
-    return urllib.parse.urlparse(url).hostname == only_domain
+    return urllib.parse.urlsplit(url).hostname == only_domain
+
+_made_dirs = set()
+_made_dirs_lock = threading.Lock()
 
-def download_one(item: DownloadItem, outdir: str, headers: Dict[str, str],
-                 timeout: int, retries: int, only_domain: Optional[str], verbose: bool):
+def ensure_dir(path: str):
+    # Thousands of segments share a handful of directories; only create each once.
+    if path in _made_dirs:
+        return
+    with _made_dirs_lock:
+        if path not in _made_dirs:
+            os.makedirs(path, exist_ok=True)
+            _made_dirs.add(path)
+
+# Linux can create an unnamed file and link it into place once complete, which
+# needs O_TMPFILE and /proc to reach the inode by fd. os.link() only issues
+# linkat(..., AT_SYMLINK_FOLLOW) when given a dir fd, hence the /proc/self/fd one.
+def _open_proc_fd_dir() -> Optional[int]:
+    if not hasattr(os, "O_TMPFILE"):
+        return None
+    try:
+        return os.open("/proc/self/fd", os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    except OSError:
+        return None
+
+_PROC_FD_DIR = _open_proc_fd_dir()
+
+def _open_tmpfile(dirpath: str) -> Optional[int]:
+    if _PROC_FD_DIR is None:
+        return None
+    try:
+        return os.open(dirpath, os.O_TMPFILE | os.O_WRONLY | os.O_CLOEXEC, 0o644)
+    except OSError:
+        # Kernel or filesystem without O_TMPFILE support
+        return None
+
+def _link_tmpfile(fd: int, dest: str):
+    src = str(fd)
+    try:
+        os.link(src, dest, src_dir_fd=_PROC_FD_DIR)
+    except FileExistsError:
+        # Overwriting an earlier download: link beside it, then swap atomically.
+        tmp = dest + ".part"
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.link(src, tmp, src_dir_fd=_PROC_FD_DIR)
+        os.replace(tmp, dest)
+
+def _write_chunks(f, chunks):
+    for chunk in chunks:
+        if chunk:
+            f.write(chunk)
+
+def write_atomic(dest: str, chunks):
+    """Write chunks so dest only ever appears complete."""
+    fd = _open_tmpfile(os.path.dirname(dest))
+    if fd is None:
+        tmp = dest + ".part"
+        with open(tmp, "wb") as f:
+            _write_chunks(f, chunks)
+        os.replace(tmp, dest)
+        return
+    with open(fd, "wb") as f:
+        _write_chunks(f, chunks)
+        f.flush()
+        _link_tmpfile(f.fileno(), dest)
+
+# A .part is only resumed with If-Range against the validator of the response
+# that started it, saved beside it, so a changed object is never spliced onto
+# an older partial.
+def part_validator(headers) -> Optional[str]:
+    # If-Range takes a strong ETag or a Last-Modified date, nothing weaker.
+    etag = headers.get("ETag", "")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+def read_part_validator(tmp: str) -> Optional[str]:
+    try:
+        with open(tmp + ".validator", encoding="latin-1") as f:
+            return f.read() or None
+    except FileNotFoundError:
+        return None
+
+def discard_part(tmp: str):
+    for path in (tmp, tmp + ".validator"):
+        if os.path.lexists(path):
+            os.remove(path)
+
+def write_part(tmp: str, dest: str, chunks, append: bool, validator: Optional[str] = None):
+    """
+    Stream into the named .part (or append the rest of an interrupted body to
+    it) and move it into place once complete. Unlike write_atomic(), whatever
+    arrived before a failure or crash stays on disk for a later Range request.
+    """
+    meta = tmp + ".validator"
+    if not append:
+        if validator:
+            with open(meta, "w", encoding="latin-1") as f:
+                f.write(validator)
+        elif os.path.lexists(meta):
+            os.remove(meta)
+    with open(tmp, "ab" if append else "wb") as f:
+        _write_chunks(f, chunks)
+    os.replace(tmp, dest)
+    if os.path.lexists(meta):
+        os.remove(meta)
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} for url: {url}")
+        self.status = status
+
+def _request(pool: SegmentPool, method: str, url: str, timeout: int,
+             extra_headers: Optional[Dict[str, str]] = None, **kw) -> "urllib3.HTTPResponse":
+    # Passing headers= replaces the pool's defaults, so merge them in.
+    headers = {**pool.headers, **extra_headers} if extra_headers else pool.headers
+    return pool.request(method, url, headers=headers,
+                        timeout=urllib3.Timeout(connect=timeout, read=timeout), **kw)
+
+def _release(r: "urllib3.HTTPResponse"):
+    # Only a fully read response may hand its socket back to the pool.
+    if not r.isclosed():
+        r.close()
+    r.release_conn()
+
+def is_unchanged(pool: SegmentPool, url: str, dest: str, timeout: int) -> bool:
+    """True if a HEAD says dest already holds the full body. Host failures propagate."""
+    try:
+        r = _request(pool, "HEAD", url, timeout)
+    except urllib3.exceptions.HTTPError as e:
+        if _is_host_failure(e):
+            raise
+        return False
+    if r.status >= 500 or r.status == 429:
+        raise HTTPStatusError(r.status, url)
+    length = r.headers.get("Content-Length", "")
+    # A compressed length says nothing about the decoded bytes we stored.
+    if not 200 <= r.status < 300 or not length.isdigit() or \
+            r.headers.get("Content-Encoding", "identity") != "identity":
+        return False
+    return int(length) == os.path.getsize(dest)
+
+# host -> [consecutive_failures, open_until (monotonic, 0 = closed), probe_in_flight]
+_breaker = defaultdict(lambda: [0, 0.0, False])
+_breaker_lock = threading.Lock()
+
+def breaker_gate(host: str) -> str:
+    """
+    "closed": send the request. "open": fail the file without a request.
+    "probe": the cool-down is over and this caller is the single half-open
+    request whose outcome (reported via breaker_record) closes or re-opens it.
+    """
+    with _breaker_lock:
+        state = _breaker[host]
+        if not state[1]:
+            return "closed"
+        if state[2] or time.monotonic() < state[1]:
+            return "open"
+        state[2] = True
+        return "probe"
+
+def breaker_record(host: str, ok: bool, threshold: int):
+    # Called once per file, not per attempt, so one bad object can't trip a healthy host.
+    with _breaker_lock:
+        state = _breaker[host]
+        if ok:
+            state[:] = [0, 0.0, False]
+            return
+        state[0] += 1
+        state[2] = False
+        # The count is kept after tripping, so a failed probe re-opens at once.
+        # Jitter keeps hosts tripped together from being probed in lockstep.
+        if threshold > 0 and state[0] >= threshold:
+            state[1] = time.monotonic() + BREAKER_COOLDOWN * random.uniform(1.0, 1.5)
+
+def _is_host_failure(e: Exception) -> bool:
+    # A 404 says nothing about the host; connection errors, 5xx and 429 do.
+    if isinstance(e, HTTPStatusError):
+        return e.status >= 500 or e.status == 429
+    return isinstance(e, (urllib3.exceptions.MaxRetryError, urllib3.exceptions.TimeoutError,
+                          urllib3.exceptions.ProtocolError))
+
+def download_one(item: DownloadItem, outdir: str, pool: SegmentPool,
+                 timeout: int, retries: int, only_domain: Optional[str], verbose: bool,
+                 resume: bool = True, breaker_threshold: int = BREAKER_THRESHOLD):
     if not check_domain(item.url, only_domain):
         return (item.url, False, "wrong domain")
     dest = os.path.join(outdir, item.relpath)
-    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    ensure_dir(os.path.dirname(dest))
+    host = urllib.parse.urlsplit(item.url).netloc
+    tmp = dest + ".part"
+    failure_recorded = False
+    if resume and os.path.exists(dest):
+        gate = breaker_gate(host)
+        if gate == "open":
+            return (item.url, False, f"circuit open for {host}")
+        try:
+            unchanged = is_unchanged(pool, item.url, dest, timeout)
+        except ProxyUnavailable as e:
+            return (item.url, False, str(e))
+        except (urllib3.exceptions.HTTPError, HTTPStatusError) as e:
+            breaker_record(host, False, breaker_threshold)
+            if gate == "probe":
+                return (item.url, False, str(e))
+            failure_recorded = True
+            unchanged = False
+        else:
+            if gate == "probe":
+                breaker_record(host, True, breaker_threshold)
+        if unchanged:
+            discard_part(tmp)  # left over from an earlier interrupted run
+            return (item.url, True, None)
     attempt = 0
     while attempt <= retries:
+        gate = breaker_gate(host)
+        if gate == "open":
+            return (item.url, False, f"circuit open for {host}")
+        offset = os.path.getsize(tmp) if resume and os.path.exists(tmp) else 0
+        validator = read_part_validator(tmp) if offset else None
+        if offset and validator is None:
+            # Nothing proves the partial belongs to the current object.
+            discard_part(tmp)
+            offset = 0
+        range_headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else None
         try:
-            with requests.get(item.url, headers=headers, stream=True, timeout=timeout) as r:
-                r.raise_for_status()
-                tmp = dest + ".part"
-                with open(tmp, "wb") as f:
-                    for chunk in r.iter_content(262144):
-                        if chunk:
-                            f.write(chunk)
-                os.replace(tmp, dest)
+            # Init segments are a few KB: read them in one go instead of streaming.
+            preload = item.kind == "init"
+            r = _request(pool, "GET", item.url, timeout, range_headers, preload_content=preload)
+            try:
+                if offset and (r.status == 416 or (
+                        r.status == 206
+                        and not r.headers.get("Content-Range", "").startswith(f"bytes {offset}-"))):
+                    # The .part no longer lines up with the remote file; start over.
+                    r.drain_conn()
+                    discard_part(tmp)
+                    if gate == "probe":
+                        breaker_record(host, True, breaker_threshold)  # the host answered
+                    continue
+                if r.status >= 400:
+                    r.drain_conn()
+                    raise HTTPStatusError(r.status, item.url)
+                chunks = (r.data,) if preload else r.stream(CHUNK_SIZE, decode_content=True)
+                if offset and r.status == 206:
+                    write_part(tmp, dest, chunks, append=True)
+                elif resume and not preload:
+                    write_part(tmp, dest, chunks, append=False, validator=part_validator(r.headers))
+                else:
+                    # Preloaded bodies are already complete, and --no-resume
+                    # never reuses a .part, so neither needs one.
+                    write_atomic(dest, chunks)
+                    if offset:
+                        discard_part(tmp)  # object changed or Range ignored; drop the stale partial
+            finally:
+                _release(r)
+            breaker_record(host, True, breaker_threshold)
             return (item.url, True, None)
         except Exception as e:
             attempt += 1
-            if attempt > retries:
+            host_failure = _is_host_failure(e)
+            if gate == "probe":
+                # A failed probe re-opens the circuit; any other outcome means
+                # the host answered, so close it and carry on as usual.
+                breaker_record(host, not host_failure, breaker_threshold)
+                if host_failure:
+                    return (item.url, False, str(e))
+            if attempt > retries or isinstance(e, ProxyUnavailable):
+                if host_failure and not failure_recorded:
+                    breaker_record(host, False, breaker_threshold)
                 return (item.url, False, str(e))
             if verbose:
                 print(f"Retry {attempt}/{retries}: {item.url} ({e})")
-            time.sleep(min(2 ** attempt, 10))
+            # Full jitter keeps workers from retrying the same host in lockstep.
+            time.sleep(random.uniform(0, min(2 ** attempt, 10)))
 
 # ---------------------------------------------------------------------------
 
 def main():
     args = parse_args()
     headers = merge_headers(args)
-    base_url, xml = read_manifest(args.manifest, headers, args.timeout)
-    items = collect_items(xml, base_url, args)
-    print(f"Discovered {len(items)} file(s).")
-    if args.dry_run:
-        for it in items[:50]:
-            print(it.url)
-        if len(items) > 50:
-            print(f"... and {len(items)-50} more")
-        return
-    os.makedirs(args.out, exist_ok=True)
-    ok = fail = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as ex:
-        futures = [ex.submit(download_one, it, args.out, headers, args.timeout,
-                             args.retry, args.only_domain, args.verbose)
-                   for it in items]
-        for f in concurrent.futures.as_completed(futures):
-            url, success, err = f.result()
-            if success:
-                ok += 1
-                if args.verbose: print("[OK]", url)
-            else:
-                fail += 1
-                print("[FAIL]", url, "->", err, file=sys.stderr)
-    print(f"Done. Success: {ok}, Failed: {fail}. Output: {os.path.abspath(args.out)}")
+    with make_session(headers) as session:
+        with open_manifest(args.manifest, session, args.timeout) as (base_url, source):
+            items = collect_items(source, base_url, args)
+        print(f"Discovered {len(items)} file(s).")
+        if args.dry_run:
+            for it in items[:50]:
+                print(it.url)
+            if len(items) > 50:
+                print(f"... and {len(items)-50} more")
+            return
+        os.makedirs(args.out, exist_ok=True)
+        # Dispatch host by host so each host's pooled keep-alive connections are
+        # reused back to back instead of interleaving hosts across the pool.
+        hosts = group_by_host(items)
+        # Init segments go first, as one burst over the fresh pools: they are tiny
+        # and every Representation needs its init before any media is playable.
+        queue = sorted((it for group in hosts.values() for it in group),
+                       key=lambda it: it.kind != "init")
+        # No host can use more sockets than there are workers or than it has items.
+        per_host = min(args.concurrency, max(map(len, hosts.values()), default=1))
+        pool = make_pool(headers, len(hosts), per_host)
+        if args.verbose:
+            print(f"Connection pools: {len(hosts)} host(s), up to {per_host} connection(s) each")
+        ok = fail = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+            futures = [ex.submit(download_one, it, args.out, pool, args.timeout,
+                                 args.retry, args.only_domain, args.verbose,
+                                 not args.no_resume, args.breaker_threshold)
+                       for it in queue]
+            for f in concurrent.futures.as_completed(futures):
+                url, success, err = f.result()
+                if success:
+                    ok += 1
+                    if args.verbose: print("[OK]", url)
+                else:
+                    fail += 1
+                    print("[FAIL]", url, "->", err, file=sys.stderr)
+        pool.clear()
+        print(f"Done. Success: {ok}, Failed: {fail}. Output: {os.path.abspath(args.out)}")
 
 if __name__ == "__main__":
     main()